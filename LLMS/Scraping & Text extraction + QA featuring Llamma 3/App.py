@@ -1,14 +1,20 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import httpx
+from aiolimiter import AsyncLimiter
+import orjson
+import hashlib
+import shelve
+import io
+from lxml import etree
 import csv
 import re
 import logging
-import time
 from tqdm import tqdm
 import os
 from dotenv import load_dotenv
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 # Load environment variables
 load_dotenv()
@@ -17,95 +23,259 @@ load_dotenv()
 logging.basicConfig(filename='clinical_trials_processing.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-def search_pubmed(keyword, page):
+# Maximum number of PubMed requests in flight at once
+MAX_CONCURRENT_REQUESTS = 10
+# Maximum number of OpenRouter calls in flight at once, kept under its rate limit
+MAX_CONCURRENT_LLM_CALLS = 8
+# Optional NCBI API key, which raises the E-utilities limit from 3 to 10 requests per second
+NCBI_API_KEY = os.getenv('NCBI_API_KEY')
+# Identification NCBI asks E-utilities clients to send as the tool/email query parameters
+NCBI_EMAIL = os.getenv('NCBI_EMAIL')
+NCBI_PARAMS = {"tool": "ClinicalTrialsExtractor"}
+if NCBI_EMAIL:
+    NCBI_PARAMS["email"] = NCBI_EMAIL
+if NCBI_API_KEY:
+    NCBI_PARAMS["api_key"] = NCBI_API_KEY
+# Token buckets that only delay a request once the per-second budget is spent
+NCBI_LIMITER = AsyncLimiter(10 if NCBI_API_KEY else 3, 1)
+LLM_LIMITER = AsyncLimiter(10, 1)
+# Number of times a rate-limited, temporarily unavailable or failed-connection request is retried
+MAX_RETRIES = 3
+RETRY_STATUSES = frozenset({429, 502, 503})
+# Transport errors raised before the request reached the server; only these are safe to
+# retry for a POST, since any other failure may already have started a paid completion
+UNSENT_REQUEST_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+# Default client timeout, and a longer read timeout for completions that fill every group field
+REQUEST_TIMEOUT = httpx.Timeout(60)
+LLM_TIMEOUT = httpx.Timeout(60, read=300)
+
+# Fields extracted by the language model for each trial and each of its study groups
+TRIAL_FIELDS = [
+    "Trial_Info", "NCT_Number", "Trial_Phase", "Cancer_Type", "Cancer_Description", "Trial_Sponsor",
+    "Novel_Findings", "Conclusions", "Unique_Information", "Subgroups_with_Heightened_Response"
+]
+
+GROUP_FIELDS = [
+    "Description", "Group_Type", "Drugs_Studied", "Treatment_ORR", "PFS", "OS", "Discontinuation_Rate",
+    "Endpoints_Met", "Cancer_Stages", "Targets", "Previous_Drug_Types", "Drug_Resistance",
+    "Drug_Type_Resistance", "Brain_Metastases", "Previous_Surgery", "Advanced_Cancer",
+    "Metastatic_Cancer", "Previously_Untreated", "Previous_Specific_Drugs",
+    "Not_Previously_Taken_Drugs", "Therapy_Line", "Treatment_Tolerance",
+    "Adverse_Reactions", "Intervention_Drug_Approval", "Other_Efficacy_Data"
+]
+
+# Number of study groups with columns in the CSV; further groups are dropped with a warning
+MAX_GROUPS = 8
+
+# (field, column name) pairs for each study group, built once rather than per parsed trial
+_GROUP_COLUMNS = [[(field, f"Group{i}_{field}") for field in GROUP_FIELDS] for i in range(1, MAX_GROUPS + 1)]
+# PubMed identifiers written first on every row, since rows are saved in completion order
+ARTICLE_FIELDS = ["PMID", "Title", "Link"]
+# CSV header: the article identifiers and trial fields, then every field of the first MAX_GROUPS groups
+CSV_FIELDNAMES = ARTICLE_FIELDS + TRIAL_FIELDS + [column for columns in _GROUP_COLUMNS for _, column in columns]
+
+# NCBI E-utilities endpoints used to search PubMed and fetch abstracts
+ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+# ESearch returns at most this many PMIDs for a PubMed query, so one request covers it
+ESEARCH_MAX_RESULTS = 10000
+# Number of PMIDs fetched with a single EFetch call
+BATCH_SIZE = 200
+# Default headers for every request, including OpenRouter: ask for compressed bodies
+# and identify the tool without any personal details
+HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "User-Agent": "ClinicalTrialsExtractor/1.0"
+}
+# On-disk cache of fetched articles and LLM responses, reused across runs
+CACHE_PATH = 'clinical_trials_cache'
+
+# Patterns used while parsing LLM output, compiled once at import
+_ID_RE = re.compile(r'(NCT\d+|ISRCTN\d+|ACTRN\d+)')
+_NAME_RE = re.compile(r':(.*?)(:|\(|$)')
+_PATIENTS_RE = re.compile(r':(\d+)')
+_PAREN_RE = re.compile(r'\s*\([^)]*\)')
+# Markdown code fence some models wrap their JSON replies in
+_CODE_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL | re.IGNORECASE)
+
+# Responses treated as missing values by clean_response
+_NA_VALUES = frozenset({'na', 'n/a', 'not specified', 'not applicable', 'not available', 'unknown', ''})
+
+def get_retry_delay(response, attempt):
     """
-    Search PubMed for clinical trials based on a keyword and page number.
+    Work out how long to wait before retrying a rate-limited or unavailable request.
     
     Args:
+        response (httpx.Response): The response that triggered the retry.
+        attempt (int): The zero-based number of the failed attempt.
+    
+    Returns:
+        float: The delay in seconds, from the Retry-After header when present, otherwise
+               an exponential backoff.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        try:
+            return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            pass
+    return 2 ** attempt
+
+async def fetch_content(client, limiter, url, method='GET', **kwargs):
+    """
+    Send a request and return its body, backing off and retrying when the server
+    rate-limits us or the connection fails. GET requests retry any transport error;
+    other methods only retry errors raised before the request was sent.
+    
+    Args:
+        client (httpx.AsyncClient): The shared HTTP/2 client.
+        limiter (AsyncLimiter): The rate limiter for the target host, acquired for every attempt.
+        url (str): The URL to request.
+        method (str): The HTTP method to use.
+        **kwargs: Extra arguments passed to the request (params, headers, content, ...).
+    
+    Returns:
+        bytes: The raw response body.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with limiter:
+                response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            retryable = method == 'GET' or isinstance(e, UNSENT_REQUEST_ERRORS)
+            if not retryable or attempt == MAX_RETRIES:
+                raise
+            logging.warning(f"Retrying {url} after transport error: {str(e)}")
+            await asyncio.sleep(2 ** attempt)
+            continue
+        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            await asyncio.sleep(get_retry_delay(response, attempt))
+            continue
+        response.raise_for_status()
+        return response.content
+
+async def search_pubmed(client, keyword):
+    """
+    Search PubMed for clinical trials based on a keyword, collecting every matching
+    PMID with a single large ESearch request.
+    
+    Args:
+        client (httpx.AsyncClient): The shared HTTP/2 client.
         keyword (str): The search term to use.
-        page (int): The page number of results to retrieve.
     
     Returns:
-        str: The HTML content of the search results page, or None if the request failed.
+        list: The PMIDs of the matching trials, or an empty list if the request failed.
     """
-    base_url = "https://pubmed.ncbi.nlm.nih.gov/"
     params = {
-        "term": f"{keyword} AND Randomized Controlled Trial[Publication Type]",
-        "filter": "simsearch1.fha",
-        "page": page
+        "db": "pubmed",
+        "term": f"{keyword} AND Randomized Controlled Trial[Publication Type] AND hasabstract",
+        "retstart": "0",
+        "retmax": str(ESEARCH_MAX_RESULTS),
+        "retmode": "json",
+        **NCBI_PARAMS
     }
     try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
+        response_content = await fetch_content(client, NCBI_LIMITER, ESEARCH_URL, params=params)
+        search_results = orjson.loads(response_content)['esearchresult']
+        # A malformed query returns only ERROR/errorlist, without count or idlist
+        count = int(search_results['count'])
+        pmids = search_results['idlist']
+    except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
         logging.error(f"Error fetching PubMed results: {str(e)}")
-        return None
+        return []
+    if count > ESEARCH_MAX_RESULTS:
+        logging.warning(f"Search matched {count} trials; PubMed only returns the first {ESEARCH_MAX_RESULTS}")
+    return pmids
 
-def get_total_pages(keyword):
+async def fetch_articles(client, pmids):
     """
-    Get the total number of pages for a given search keyword.
+    Retrieve the titles and abstracts of a batch of articles with a single EFetch call.
     
     Args:
-        keyword (str): The search term to use.
+        client (httpx.AsyncClient): The shared HTTP/2 client.
+        pmids (list): The PubMed IDs of the articles to retrieve.
     
     Returns:
-        int: The total number of pages, or 0 if the request failed.
+        bytes: The PubMed XML for the articles, or None if retrieval failed.
     """
-    html_content = search_pubmed(keyword, 1)
-    if html_content:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        results_count = soup.find('span', class_='value').text.replace(',', '')
-        return int(int(results_count) / 10) + 1
-    return 0
+    params = {
+        "db": "pubmed",
+        "id": ",".join(pmids),
+        "retmode": "xml",
+        "rettype": "abstract",
+        **NCBI_PARAMS
+    }
+    try:
+        return await fetch_content(client, NCBI_LIMITER, EFETCH_URL, params=params)
+    except httpx.HTTPError as e:
+        logging.error(f"Error fetching article abstracts: {str(e)}")
+        return None
 
-def extract_trial_info(html_content):
+def parse_article(element):
     """
-    Extract trial information from the HTML content of a PubMed search results page.
+    Extract the PMID, title and abstract from a single PubmedArticle element.
     
     Args:
-        html_content (str): The HTML content of the search results page.
+        element (lxml.etree._Element): The PubmedArticle element.
     
     Returns:
-        list: A list of dictionaries containing trial titles and links.
+        dict: The trial PMID, title, link and abstract, or None if the element has no citation.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    articles = soup.find_all('article', class_='full-docsum')
-    trials = []
-    for article in articles:
-        title = article.find('a', class_='docsum-title').text.strip()
-        link = "https://pubmed.ncbi.nlm.nih.gov" + article.find('a', class_='docsum-title')['href']
-        trials.append({'title': title, 'link': link})
-    return trials
+    citation = element.find('MedlineCitation')
+    if citation is None:
+        return None
+    pmid = citation.findtext('PMID')
+    # Locate the Article node once and use direct child paths from it, rather than
+    # repeated './/' searches through the reference and MeSH lists
+    article = citation.find('Article')
+    title_node = article.find('ArticleTitle') if article is not None else None
+    title = ''.join(title_node.itertext()).strip() if title_node is not None else "Untitled"
+    abstract_parts = []
+    for part in (article.iterfind('Abstract/AbstractText') if article is not None else ()):
+        text = ''.join(part.itertext()).strip()
+        label = part.get('Label')
+        abstract_parts.append(f"{label}: {text}" if label else text)
+    return {
+        'pmid': pmid,
+        'title': title,
+        'link': f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/",
+        'abstract': ' '.join(abstract_parts) or "No abstract available"
+    }
 
-def get_full_article_text(url):
+def extract_trial_info(xml_content):
     """
-    Retrieve the full text of an article from its PubMed URL.
+    Extract trial information from the EFetch XML of a batch of PubMed articles.
     
     Args:
-        url (str): The URL of the article on PubMed.
+        xml_content (bytes): The PubMed XML returned by EFetch.
     
     Returns:
-        str: The abstract text of the article, or None if retrieval failed.
+        list: A list of dictionaries containing trial PMIDs, titles, links and abstracts.
     """
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        abstract = soup.find('div', class_='abstract-content selected')
-        if abstract:
-            return abstract.get_text(strip=True)
-        else:
-            return "No abstract available"
-    except requests.RequestException as e:
-        logging.error(f"Error fetching full article text: {str(e)}")
-        return None
+    trials = []
+    # Only PubmedArticle elements are reported, and each is dropped once read so the
+    # tree never holds more than one article's reference and MeSH lists
+    for _, element in etree.iterparse(io.BytesIO(xml_content), events=('end',), tag='PubmedArticle'):
+        trial = parse_article(element)
+        if trial is not None:
+            trials.append(trial)
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return trials
 
-def process_trial_with_llm(trial_text):
+async def process_trial_with_llm(client, cache, trial_text):
     """
     Process the trial text using a language model to extract structured information.
+    Responses are cached on disk, keyed by a hash of the request, so reruns skip the API call.
 
     Args:
+        client (httpx.AsyncClient): The shared HTTP/2 client.
+        cache (shelve.Shelf): The on-disk response cache.
         trial_text (str): The full text of the clinical trial article.
 
     Returns:
@@ -123,41 +293,52 @@ def process_trial_with_llm(trial_text):
 
     {trial_text}
 
-    Please provide the information in the following format:
-
-    Trial Information:
-    Trial_Info: [Brief description of the trial]
-    NCT_Number: [NCT number if available, otherwise "NA"]
-    Trial_Phase: [Trial phase if available, otherwise "NA"]
-    Cancer_Type: [Type of cancer studied]
-    Cancer_Description: [Brief description of the cancer type and stage]
-    Trial_Sponsor: [Name of the trial sponsor]
-
-    Study Groups:
-    Group1: Description: [Brief description], Group_Type: [Control/Intervention], Drugs_Studied: [List of drugs], Treatment_ORR: [ORR if available], PFS: [PFS if available], OS: [OS if available], Discontinuation_Rate: [Rate if available], Endpoints_Met: [Yes/No/NA], Cancer_Stages: [Stages included], Targets: [Molecular targets if applicable], Previous_Drug_Types: [Types of previous treatments], Drug_Resistance: [Any information on drug resistance], Drug_Type_Resistance: [Specific drug types if resistant], Brain_Metastases: [Yes/No/NA], Previous_Surgery: [Yes/No/NA], Advanced_Cancer: [Yes/No/NA], Metastatic_Cancer: [Yes/No/NA], Previously_Untreated: [Yes/No/NA], Previous_Specific_Drugs: [List if applicable], Not_Previously_Taken_Drugs: [List if applicable], Therapy_Line: [First-line/Second-line/etc.], Treatment_Tolerance: [Any information on tolerance], Adverse_Reactions: [List of significant adverse reactions], Intervention_Drug_Approval: [Approval status if mentioned], Other_Efficacy_Data: [Any other relevant efficacy information]
+    Respond with a single JSON object using exactly these keys:
 
-    [Repeat Group information for each study group]
-
-    Trial Results:
-    Novel_Findings: [Brief description of novel findings]
-    Conclusions: [Main conclusions of the trial]
-    Unique_Information: [Any unique aspects of this trial]
-    Subgroups_with_Heightened_Response: [Any subgroups that showed better response, if applicable]
+    {{
+        "Trial_Info": "Brief description of the trial",
+        "NCT_Number": "NCT number if available, otherwise NA",
+        "Trial_Phase": "Trial phase if available, otherwise NA",
+        "Cancer_Type": "Type of cancer studied",
+        "Cancer_Description": "Brief description of the cancer type and stage",
+        "Trial_Sponsor": "Name of the trial sponsor",
+        "groups": [
+            {{
+                "Description": "Brief description", "Group_Type": "Control/Intervention", "Drugs_Studied": "List of drugs", "Treatment_ORR": "ORR if available", "PFS": "PFS if available", "OS": "OS if available", "Discontinuation_Rate": "Rate if available", "Endpoints_Met": "Yes/No/NA", "Cancer_Stages": "Stages included", "Targets": "Molecular targets if applicable", "Previous_Drug_Types": "Types of previous treatments", "Drug_Resistance": "Any information on drug resistance", "Drug_Type_Resistance": "Specific drug types if resistant", "Brain_Metastases": "Yes/No/NA", "Previous_Surgery": "Yes/No/NA", "Advanced_Cancer": "Yes/No/NA", "Metastatic_Cancer": "Yes/No/NA", "Previously_Untreated": "Yes/No/NA", "Previous_Specific_Drugs": "List if applicable", "Not_Previously_Taken_Drugs": "List if applicable", "Therapy_Line": "First-line/Second-line/etc.", "Treatment_Tolerance": "Any information on tolerance", "Adverse_Reactions": "List of significant adverse reactions", "Intervention_Drug_Approval": "Approval status if mentioned", "Other_Efficacy_Data": "Any other relevant efficacy information"
+            }}
+        ],
+        "Novel_Findings": "Brief description of novel findings",
+        "Conclusions": "Main conclusions of the trial",
+        "Unique_Information": "Any unique aspects of this trial",
+        "Subgroups_with_Heightened_Response": "Any subgroups that showed better response, if applicable"
+    }}
 
+    Include one entry in "groups" for each study group. All values must be strings.
     Please fill in the information as accurately as possible based on the provided text. If information for a field is not available, please use "NA".
     """
     data = {
         "model": "meta-llama/llama-3.1-70b-instruct",  # You can change this to another model if needed
         "messages": [
-            {"role": "system", "content": "You are a helpful assistant that analyzes clinical trial data."},
+            {"role": "system", "content": "You are a helpful assistant that analyzes clinical trial data and replies only with JSON."},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        "response_format": {"type": "json_object"}
     }
+    payload = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    cache_key = "llm:" + hashlib.sha256(payload).hexdigest()
+    cached_content = cache.get(cache_key)
+    if cached_content is not None:
+        return cached_content
     
     try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        return response.json()['choices'][0]['message']['content']
+        response_content = await fetch_content(client, LLM_LIMITER, url, method='POST', headers=headers,
+                                               content=payload, timeout=LLM_TIMEOUT)
+        content = orjson.loads(response_content)['choices'][0]['message']['content']
+        # Only cache replies that parse, so a malformed one is retried on the next run
+        content = strip_code_fence(content)
+        load_llm_json(content)
+        cache[cache_key] = content
+        return content
     except Exception as e:
         logging.error(f"Error in LLM processing: {e}")
         return None
@@ -172,13 +353,13 @@ def standardize_trial_info(info):
     Returns:
         str: A standardized string in the format "ID:Name:Patients".
     """
-    id_match = re.search(r'(NCT\d+|ISRCTN\d+|ACTRN\d+)', info)
+    id_match = _ID_RE.search(info)
     trial_id = id_match.group(1) if id_match else "NoID"
     
-    name_match = re.search(r':(.*?)(:|\(|$)', info)
+    name_match = _NAME_RE.search(info)
     name = name_match.group(1).strip() if name_match else "Unnamed Trial"
     
-    patients_match = re.search(r':(\d+)', info)
+    patients_match = _PATIENTS_RE.search(info)
     patients = patients_match.group(1) if patients_match else "0"
     
     return f"{trial_id}:{name}:{patients}"
@@ -194,10 +375,13 @@ def clean_response(response, max_length=100):
     Returns:
         str: The cleaned and truncated response string.
     """
-    if not response or response.strip().lower() in ['na', 'n/a', 'not specified', 'not applicable', 'not available', 'unknown']:
+    if not response:
         return "NA"
-    response = re.sub(r'\s*\([^)]*\)', '', response)  # Remove parenthetical explanations
     response = response.strip()
+    if response.casefold() in _NA_VALUES:
+        return "NA"
+    if '(' in response:
+        response = _PAREN_RE.sub('', response).strip()  # Remove parenthetical explanations
     if len(response) > max_length:
         return response[:max_length] + "..."
     return response
@@ -223,118 +407,177 @@ def parse_group_info(group_info):
     
     return group_type, intervention, description
 
+def strip_code_fence(content):
+    """
+    Remove a Markdown code fence wrapped around a language model reply.
+    
+    Args:
+        content (str): The raw reply text.
+    
+    Returns:
+        str: The reply without the surrounding fence.
+    """
+    if not isinstance(content, str):
+        raise ValueError(f"Expected a text reply from the language model, got {type(content).__name__}")
+    match = _CODE_FENCE_RE.match(content)
+    return match.group(1) if match else content
+
+def load_llm_json(content):
+    """
+    Decode a language model reply that must hold a single JSON object.
+    
+    Args:
+        content (str): The reply text, without a code fence.
+    
+    Returns:
+        dict: The decoded JSON object.
+    """
+    obj = orjson.loads(content)
+    if not isinstance(obj, dict):
+        raise ValueError(f"Expected a JSON object from the language model, got {type(obj).__name__}")
+    return obj
+
+def _format_value(value):
+    """
+    Convert a JSON value from the language model into a CSV cell.
+    
+    Args:
+        value: The decoded JSON value.
+    
+    Returns:
+        str: The value as text, with lists joined, objects serialized as JSON and
+             missing values set to "NA".
+    """
+    if value is None or value == "":
+        return "NA"
+    if isinstance(value, list):
+        return ", ".join(_format_value(item) for item in value) or "NA"
+    if isinstance(value, dict):
+        return orjson.dumps(value).decode('utf-8')
+    return str(value)
+
 def parse_llm_response(response):
-    trials = []
-    current_trial = {}
-    
-    # Define all expected fields
-    trial_fields = [
-        "Trial_Info", "NCT_Number", "Trial_Phase", "Cancer_Type", "Cancer_Description", "Trial_Sponsor",
-        "Novel_Findings", "Conclusions", "Unique_Information", "Subgroups_with_Heightened_Response"
-    ]
-    
-    group_fields = [
-        "Description", "Group_Type", "Drugs_Studied", "Treatment_ORR", "PFS", "OS", "Discontinuation_Rate",
-        "Endpoints_Met", "Cancer_Stages", "Targets", "Previous_Drug_Types", "Drug_Resistance",
-        "Drug_Type_Resistance", "Brain_Metastases", "Previous_Surgery", "Advanced_Cancer",
-        "Metastatic_Cancer", "Previously_Untreated", "Previous_Specific_Drugs",
-        "Not_Previously_Taken_Drugs", "Therapy_Line", "Treatment_Tolerance",
-        "Adverse_Reactions", "Intervention_Drug_Approval", "Other_Efficacy_Data"
-    ]
-    
-    # Initialize the current trial with all fields
-    for field in trial_fields:
-        current_trial[field] = "NA"
-    
-    lines = response.split('\n')
-    section = None
-    current_group = None
-    group_count = 0
-    
-    for line in lines:
-        line = line.strip()
-        
-        if line.startswith("Trial Information:"):
-            section = "trial_info"
-        elif line.startswith("Study Groups:"):
-            section = "groups"
-        elif line.startswith("Trial Results:"):
-            section = "results"
-        
-        if section == "trial_info":
-            for field in trial_fields:
-                if line.startswith(f"{field}:"):
-                    current_trial[field] = line.split(":", 1)[1].strip()
-        
-        elif section == "groups":
-            match = re.match(r'Group(\d+):(.*)', line)
-            if match:
-                group_num = int(match.group(1))
-                group_count = max(group_count, group_num)
-                current_group = group_num
-                group_info = match.group(2).strip()
-                for field in group_fields:
-                    if f"{field}:" in group_info:
-                        value = group_info.split(f"{field}:", 1)[1].split(",", 1)[0].strip()
-                        current_trial[f"Group{group_num}_{field}"] = value
-        
-        elif section == "results":
-            if line.startswith("Novel Findings:"):
-                current_trial["Novel_Findings"] = line.split(":", 1)[1].strip()
-            elif line.startswith("Conclusions:"):
-                current_trial["Conclusions"] = line.split(":", 1)[1].strip()
-            elif line.startswith("Unique Information:"):
-                current_trial["Unique_Information"] = line.split(":", 1)[1].strip()
-            elif line.startswith("Subgroups with Heightened Response:"):
-                current_trial["Subgroups_with_Heightened_Response"] = line.split(":", 1)[1].strip()
-    
-    # Ensure all group fields are present for each group
-    for i in range(1, group_count + 1):
-        for field in group_fields:
-            if f"Group{i}_{field}" not in current_trial:
-                current_trial[f"Group{i}_{field}"] = "NA"
-    
-    trials.append(current_trial)
-    return trials
+    """
+    Parse the language model's JSON response into a flat trial record.
+    
+    Args:
+        response (str): The JSON object returned by the language model.
+    
+    Returns:
+        tuple: The trial dictionary, with fields of the first MAX_GROUPS groups named
+               GroupN_<field>, and the total number of study groups in the trial.
+    """
+    obj = load_llm_json(strip_code_fence(response))
+    trial = {field: _format_value(obj.get(field)) for field in TRIAL_FIELDS}
+    groups = obj.get("groups")
+    if not isinstance(groups, list):
+        groups = []
+    # Skip malformed group entries rather than losing the whole trial
+    groups = [group for group in groups if isinstance(group, dict)]
+    # Groups past MAX_GROUPS have no CSV columns, so they are only counted
+    for columns, group in zip(_GROUP_COLUMNS, groups[:MAX_GROUPS]):
+        for field, column in columns:
+            trial[column] = _format_value(group.get(field))
+    return trial, len(groups)
 
-def save_to_csv(trials, filename):
-    # Find the maximum number of groups across all trials
-    max_groups = 0
-    for trial in trials:
-        group_fields = [key for key in trial.keys() if key.startswith("Group")]
-        if group_fields:
-            max_group = max([int(key.split("_")[0][5:]) for key in group_fields])
-            max_groups = max(max_groups, max_group)
-    
-    fieldnames = [
-        "Trial_Info", "NCT_Number", "Trial_Phase", "Cancer_Type", "Cancer_Description", "Trial_Sponsor",
-        "Novel_Findings", "Conclusions", "Unique_Information", "Subgroups_with_Heightened_Response"
-    ]
-    
-    group_fields = [
-        "Description", "Group_Type", "Drugs_Studied", "Treatment_ORR", "PFS", "OS", "Discontinuation_Rate",
-        "Endpoints_Met", "Cancer_Stages", "Targets", "Previous_Drug_Types", "Drug_Resistance",
-        "Drug_Type_Resistance", "Brain_Metastases", "Previous_Surgery", "Advanced_Cancer",
-        "Metastatic_Cancer", "Previously_Untreated", "Previous_Specific_Drugs",
-        "Not_Previously_Taken_Drugs", "Therapy_Line", "Treatment_Tolerance",
-        "Adverse_Reactions", "Intervention_Drug_Approval", "Other_Efficacy_Data"
-    ]
-    
-    for i in range(1, max_groups + 1):
-        for field in group_fields:
-            fieldnames.append(f"Group{i}_{field}")
-    
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for trial in trials:
-            # Ensure all fields are present in the trial dictionary
-            for field in fieldnames:
-                if field not in trial:
-                    trial[field] = "NA"
-            writer.writerow(trial)
-
-def main():
+def write_trial(writer, csvfile, trial, group_count):
+    """
+    Append a parsed trial to the open CSV file and flush it to disk.
+    
+    Args:
+        writer (csv.DictWriter): Writer created with CSV_FIELDNAMES.
+        csvfile (file): The file object the writer writes to.
+        trial (dict): The parsed trial to write.
+        group_count (int): The number of study groups reported by parse_llm_response.
+    """
+    if group_count > MAX_GROUPS:
+        logging.warning(f"Trial has {group_count} groups; only the first {MAX_GROUPS} are saved: "
+                        f"{trial['Trial_Info']}")
+    writer.writerow(trial)
+    csvfile.flush()
+
+async def process_trial(client, cache, llm_semaphore, trial):
+    """
+    Run a single trial's abstract through the language model.
+    
+    Args:
+        client (httpx.AsyncClient): The shared HTTP/2 client.
+        cache (shelve.Shelf): The on-disk article and response cache.
+        llm_semaphore (asyncio.Semaphore): Bounds the number of concurrent LLM calls.
+        trial (dict): A dictionary containing the trial title, link and abstract.
+    
+    Returns:
+        tuple: The parsed trial, labelled with its PMID, title and link, and its number of
+               study groups, or None if processing failed.
+    """
+    try:
+        async with llm_semaphore:
+            print(f"Processing: {trial['title']}")
+            logging.info(f"Processing: {trial['title']}")
+            llm_response = await process_trial_with_llm(client, cache, trial['abstract'])
+        if llm_response:
+            parsed_trial, group_count = parse_llm_response(llm_response)
+            article = {"PMID": trial['pmid'], "Title": trial['title'], "Link": trial['link']}
+            return {**article, **parsed_trial}, group_count
+        logging.warning(f"No LLM response for trial: {trial['title']}")
+    except Exception as e:
+        logging.error(f"Error processing trial {trial['title']}: {str(e)}")
+    return None
+
+async def process_batch(client, cache, semaphore, llm_semaphore, writer, csvfile, pmids, pbar):
+    """
+    Process a batch of PubMed articles, writing each trial to the CSV as soon as it
+    has been parsed.
+    
+    Args:
+        client (httpx.AsyncClient): The shared HTTP/2 client.
+        cache (shelve.Shelf): The on-disk article and response cache.
+        semaphore (asyncio.Semaphore): Bounds the number of concurrent PubMed requests.
+        llm_semaphore (asyncio.Semaphore): Bounds the number of concurrent LLM calls.
+        writer (csv.DictWriter): Writer for the output CSV.
+        csvfile (file): The file object the writer writes to.
+        pmids (list): The PMIDs of the articles in the batch.
+        pbar (tqdm): Progress bar updated once the batch is done.
+    
+    Returns:
+        int: The number of trials written for the batch.
+    """
+    logging.info(f"Processing batch of {len(pmids)} articles starting at PMID {pmids[0]}")
+    # Only fetch articles that are not already cached from a previous run
+    articles = {pmid: cache.get(f"article:{pmid}") for pmid in pmids}
+    missing_pmids = [pmid for pmid, article in articles.items() if article is None]
+    xml_content = None
+    if missing_pmids:
+        async with semaphore:
+            xml_content = await fetch_articles(client, missing_pmids)
+    if xml_content is not None:
+        try:
+            for trial in extract_trial_info(xml_content):
+                cache[f"article:{trial['pmid']}"] = trial
+                articles[trial['pmid']] = trial
+        except etree.ParseError as e:
+            logging.error(f"Error parsing articles in batch starting at PMID {pmids[0]}: {str(e)}")
+    trials = [article for article in articles.values() if article is not None]
+
+    trials_written = 0
+    tasks = [asyncio.ensure_future(process_trial(client, cache, llm_semaphore, trial)) for trial in trials]
+    for future in asyncio.as_completed(tasks):
+        try:
+            result = await future
+        except Exception as e:
+            logging.error(f"Error processing trial in batch starting at PMID {pmids[0]}: {str(e)}")
+            continue
+        if result is None:
+            continue
+        parsed_trial, group_count = result
+        write_trial(writer, csvfile, parsed_trial, group_count)
+        trials_written += 1
+    # Persist the batch's articles and LLM replies once, rather than after every reply
+    cache.sync()
+    pbar.update(1)
+    return trials_written
+
+async def main():
     """
     Main function to orchestrate the PubMed clinical trial data extraction process.
     This function handles user input, initiates the search process, and manages the
@@ -342,49 +585,45 @@ def main():
     """
     
     keyword = input("Enter the keyword to search in PubMed: ")
-    total_pages = get_total_pages(keyword)
-    print(f"Total number of pages: {total_pages}")
-    start_page = int(input("Enter the starting page number: "))
-    end_page = int(input("Enter the ending page number: "))
-
-    all_trials = []
-    print("Processing trials...")
-
-    with tqdm(total=end_page - start_page + 1, desc="Pages processed", unit="page") as pbar:
-        for page in range(start_page, end_page + 1):
-            logging.info(f"Processing page {page}")
-            html_content = search_pubmed(keyword, page)
-            if html_content is None:
-                continue
-            trials = extract_trial_info(html_content)
-
-            for trial in trials:
-                try:
-                    print(f"Processing: {trial['title']}")
-                    logging.info(f"Processing: {trial['title']}")
-                    trial_text = get_full_article_text(trial['link'])
-                    if trial_text is None:
-                        continue
-                    llm_response = process_trial_with_llm(trial_text)
-                    if llm_response:
-                        parsed_trials = parse_llm_response(llm_response)
-                        all_trials.extend(parsed_trials)
-                    else:
-                        logging.warning(f"No LLM response for trial: {trial['title']}")
-                except Exception as e:
-                    logging.error(f"Error processing trial {trial['title']}: {str(e)}")
-
-                time.sleep(1)
-
-            pbar.update(1)
+
+    limits = httpx.Limits(max_connections=100)
+    with shelve.open(CACHE_PATH) as cache:
+        async with httpx.AsyncClient(http2=True, timeout=REQUEST_TIMEOUT, limits=limits, headers=HEADERS) as client:
+            all_pmids = await search_pubmed(client, keyword)
+            if not all_pmids:
+                print("No results found, or the PubMed search failed. See clinical_trials_processing.log for details.")
+                return
+            print(f"Total number of results: {len(all_pmids)}")
+            start_index = int(input("Enter the starting result number: "))
+            end_index = int(input("Enter the ending result number: "))
+            # Keep the range within 1..len(all_pmids) so out-of-range input can't wrap around
+            start_index = max(start_index, 1)
+            end_index = min(end_index, len(all_pmids))
+            if start_index > end_index:
+                print(f"No results between {start_index} and {end_index}.")
+            pmids = all_pmids[start_index - 1:end_index] if start_index <= end_index else []
+            batches = [pmids[i:i + BATCH_SIZE] for i in range(0, len(pmids), BATCH_SIZE)]
+
+            print("Processing trials...")
+
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+            llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+            with open('clinical_trials_data.csv', 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=CSV_FIELDNAMES, restval="NA", extrasaction='ignore')
+                writer.writeheader()
+                with tqdm(total=len(batches), desc="Batches processed", unit="batch") as pbar:
+                    results = await asyncio.gather(
+                        *(process_batch(client, cache, semaphore, llm_semaphore, writer, csvfile, batch, pbar)
+                          for batch in batches)
+                    )
+            total_trials = sum(results)
 
     print("Processing complete.")
 
-    if all_trials:
-        save_to_csv(all_trials, 'clinical_trials_data.csv')
-        print(f"Data has been saved to clinical_trials_data.csv. Total trials processed: {len(all_trials)}")
+    if total_trials:
+        print(f"Data has been saved to clinical_trials_data.csv. Total trials processed: {total_trials}")
     else:
         print("No data was successfully processed and parsed.")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())